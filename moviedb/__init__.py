@@ -1,14 +1,17 @@
 # Contém a application factory
+import hmac
 import json
 import logging
 import os
 import sys
+import uuid
 from functools import wraps
 
-from flask import Flask
+from flask import flash, Flask, redirect, url_for
+from flask_login import current_user
 
 from moviedb.infra import app_logging
-from moviedb.infra.modulos import bootstrap, db, login_manager, migrate
+from moviedb.infra.modulos import bootstrap, compress, db, limiter, login_manager, migrate
 
 
 def anonymous_required(f):
@@ -27,8 +30,6 @@ def anonymous_required(f):
 
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        from flask_login import current_user
-        from flask import redirect, url_for, flash
         if current_user.is_authenticated:
             flash("Acesso não autorizado para usuários logados no sistema", category='warning')
             return redirect(url_for('root.index'))
@@ -51,20 +52,20 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
 
     app_logging.configure_logging(logging.DEBUG)
 
-    app.logger.debug("Configurando a aplicação a partir do arquivo '%s'" % (config_filename,))
+    app.logger.debug("Configurando a aplicação a partir do arquivo '%s'", config_filename)
     try:
         app.config.from_file(config_filename,
                              load=json.load)
     except FileNotFoundError:
-        app.logger.fatal("O arquivo de configuração '%s' não existe" % (config_filename,))
+        app.logger.fatal("O arquivo de configuração '%s' não existe", config_filename)
         sys.exit(1)
     except json.JSONDecodeError as e:
         app.logger.fatal(
-            "O arquivo de configuração '%s' não é um JSON válido: %s" % (config_filename, str(e),))
+            "O arquivo de configuração '%s' não é um JSON válido: %s", config_filename, e)
         sys.exit(1)
     except Exception as e:
         app.logger.fatal(
-            "Erro ao carregar o arquivo de configuração '%s': %s" % (config_filename, str(e),))
+            "Erro ao carregar o arquivo de configuração '%s': %s", config_filename, e)
         sys.exit(1)
 
     if "SQLALCHEMY_DATABASE_URI" not in app.config:
@@ -85,7 +86,7 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
     if "SECRET_KEY" not in app.config or app.config.get("SECRET_KEY") is None:
         secret_key = os.urandom(32).hex()
         app.logger.warning("A chave 'SECRET_KEY' não está presente no arquivo de configuração")
-        app.logger.warning("Gerando chave aleatória: '%s'" % (secret_key,))
+        app.logger.warning("Gerando chave aleatória: '%s'", secret_key)
         app.logger.warning("Para não invalidar os tokens gerados nesta instância da aplicação, "
                            "adicione a chave acima ao arquivo de configuração")
         app.config["SECRET_KEY"] = secret_key
@@ -95,6 +96,8 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
     db.init_app(app)
     migrate.init_app(app, db, compare_type=True)
     login_manager.init_app(app)
+    limiter.init_app(app)
+    compress.init_app(app)
 
     app.logger.debug("Registrando blueprints")
     from moviedb.blueprints.root import bp as root_bp
@@ -112,15 +115,18 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
 
     @login_manager.user_loader
     def load_user(user_id):  # https://flask-login.readthedocs.io/en/latest/#alternative-tokens
-        import uuid
         from moviedb.models.autenticacao import User
-        identifier, final_password = user_id.split('|', 1)
+        identifier, _, final_password = user_id.partition('|')
         try:
             auth_id = uuid.UUID(identifier)
         except ValueError:
             return None
         user = User.get_by_id(auth_id)
-        return user if user and user.password.endswith(final_password) else None
+        # Compara o final do hash em tempo constante. Um sufixo vazio não é aceito.
+        if user is None or not final_password or \
+                not hmac.compare_digest(user.password[-15:].encode(), final_password.encode()):
+            return None
+        return user
 
     app.logger.info("Aplicação configurada com sucesso")
     return app
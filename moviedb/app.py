@@ -1,8 +1,14 @@
+import os
+
 from moviedb import create_app
 
+# A aplicação é criada uma única vez, na importação do módulo. Assim, servidores WSGI que
+# fazem o preload da aplicação antes do fork (ex.: gunicorn --preload app:app) compartilham
+# a mesma instância entre os workers.
+app = create_app(os.environ.get('MOVIEDB_CONFIG', 'config.dev.json'))
+
 
 def run():
-    app = create_app()
     app.logger.info("Aplicação iniciada")
     app.run(host=app.config['APP_HOST'],
             port=app.config['APP_PORT'],
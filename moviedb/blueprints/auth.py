@@ -1,12 +1,16 @@
+import re
+from typing import Optional
 from urllib.parse import urlsplit
 from uuid import UUID
 
 from flask import Blueprint, current_app, flash, redirect, render_template, request, Response, \
     session, url_for
+from flask_limiter import RateLimitExceeded
+from flask_limiter.util import get_remote_address
 from flask_login import current_user, login_required, login_user, logout_user
 from markupsafe import Markup
 
-from moviedb import anonymous_required, db
+from moviedb import anonymous_required, db, limiter
 from moviedb.forms.auth import AskToResetPasswordForm, LoginForm, ProfileForm, Read2FACodeForm, \
     RegistrationForm, \
     SetNewPasswordForm
@@ -18,6 +22,135 @@ bp = Blueprint(name='auth',
                import_name=__name__,
                url_prefix='/auth')
 
+_CARACTERES_DE_CONTROLE = re.compile(r'[\x00-\x1f\x7f]')
+
+# O operador % de Markup escapa o argumento (a URL) antes de inseri-lo no HTML
+_MENSAGEM_USUARIO_IMPEDIDO = Markup("Usuário está impedido de acessar o sistema. Precisa de um "
+                                    "<a href=\"%s\">novo email de confirmacao</a>?")
+
+
+def _is_safe_next(url: Optional[str]) -> bool:
+    """
+    Verifica se o destino informado em 'next' é um caminho relativo da própria aplicação.
+
+    Aceita apenas caminhos iniciados por '/', recusando os relativos ao protocolo ('//host'),
+    os que contêm barras invertidas, que alguns navegadores tratam como '/', e os que contêm
+    caracteres de controle (os navegadores descartam tab e quebras de linha, de modo que
+    '/\\t/host' vira '//host'). Por fim, o destino não pode ter esquema nem domínio.
+
+    Args:
+        url (str): destino a ser verificado.
+
+    Returns:
+        bool: True se o redirecionamento para o destino for seguro.
+    """
+    if not url or not url.startswith('/') or url.startswith('//') or '\\' in url:
+        return False
+    if _CARACTERES_DE_CONTROLE.search(url):
+        return False
+    partes = urlsplit(url)
+    return not partes.scheme and not partes.netloc
+
+
+def _chave_email_do_formulario() -> str:
+    """
+    Chave para o limite de tentativas baseada no email informado no formulário.
+
+    Returns:
+        str: o email normalizado enviado no formulário, ou o IP de origem se não houver email.
+    """
+    return normalizar_email(request.form.get('email', '')) or get_remote_address()
+
+
+def _chave_sub_do_token() -> str:
+    """
+    Chave para o limite de tentativas baseada no 'sub' do token JWT da URL.
+
+    O 'sub' só é usado se o token for válido, para não usar como chave um dado que não foi
+    verificado. A verificação fica memorizada na requisição e não é repetida pela view.
+
+    Returns:
+        str: o 'sub' do token, ou o IP de origem se o token for inválido.
+    """
+    claims = verify_jwt_token(request.view_args.get('token', ''))
+    if claims.valid and claims.sub:
+        return str(claims.sub)
+    return get_remote_address()
+
+
+def _chave_sub_do_2fa_pendente() -> str:
+    """
+    Chave para o limite de tentativas baseada no 'sub' do token de 2FA pendente da sessão.
+
+    Limita as tentativas por conta, e não apenas por IP, para que o código TOTP ou um código
+    reserva não possa ser descoberto por força bruta distribuindo as requisições entre vários
+    IPs. Assim como em _chave_sub_do_token, o 'sub' só é usado se o token for válido.
+
+    Returns:
+        str: o 'sub' do token de 2FA pendente, ou o IP de origem se o token for inválido.
+    """
+    claims = verify_jwt_token(session.get('pending_2fa_token', ''))
+    if claims.valid and claims.sub and claims.action is JWT_action.PENDING_2FA:
+        return str(claims.sub)
+    return get_remote_address()
+
+
+@bp.after_request
+def _cabecalhos_de_cache(response: Response) -> Response:
+    """
+    Impede que as páginas HTML do blueprint sejam armazenadas em cache ou comprimidas.
+
+    As páginas de autenticação contêm o token CSRF do formulário e dados do usuário, e não
+    devem ser reaproveitadas pelo navegador nem por proxies. Como o conteúdo depende da
+    sessão, todas as respostas do blueprint variam conforme o cookie. As imagens (rota
+    imagem) definem os próprios cabeçalhos de cache.
+
+    Essas páginas também não são comprimidas: um segredo (o token CSRF) junto de dados
+    refletidos da requisição (o email devolvido no formulário) em uma resposta comprimida
+    permite o ataque BREACH. O Flask-Compress ignora respostas que já têm Content-Encoding,
+    e este hook do blueprint é executado antes do hook da aplicação que faz a compressão.
+
+    Args:
+        response (Response): resposta gerada pela view.
+
+    Returns:
+        Response: a mesma resposta, com os cabeçalhos Cache-Control, Vary e Content-Encoding
+        ajustados.
+    """
+    response.vary.add('Cookie')
+    if response.mimetype == 'text/html':
+        response.cache_control.no_store = True
+        response.headers.setdefault('Content-Encoding', 'identity')
+    return response
+
+
+@bp.errorhandler(RateLimitExceeded)
+def limite_excedido(e):
+    """
+    Trata o excesso de tentativas nas rotas de autenticação.
+
+    Exibe uma mensagem genérica. Se o limite foi excedido em um POST, redireciona para a
+    própria rota via GET, preservando os argumentos da URL e da query string (por exemplo, o
+    parâmetro 'next' do login), que exibe novamente o formulário; caso contrário, redireciona
+    para a página inicial. A URL é montada com url_for, que respeita o prefixo em que a
+    aplicação está montada (SCRIPT_NAME).
+
+    Args:
+        e (RateLimitExceeded): exceção gerada pelo Flask-Limiter.
+
+    Returns:
+        Response: Redireciona para o formulário ou para a página inicial.
+    """
+    current_app.logger.warning("Limite de tentativas excedido em %s a partir do IP %s (%s)",
+                               request.path, request.remote_addr, e.description)
+    flash("Muitas tentativas em pouco tempo. Aguarde alguns minutos e tente novamente.",
+          category='warning')
+    if request.method == 'POST':
+        # Os argumentos da rota prevalecem sobre parâmetros homônimos da query string
+        return redirect(url_for(request.endpoint,
+                                **{**request.args.to_dict(), **(request.view_args or {})}))
+    return redirect(url_for('root.index'))
+
 
 @bp.route('/register', methods=['GET', 'POST'])
 @anonymous_required
@@ -44,18 +177,17 @@ def register():
         usuario.ativo = False
         usuario.password = form.password.data
         db.session.add(usuario)
-        # Realiza o flush para garantir que o usuário tenha um ID gerado antes do commit.
-        db.session.flush()
-        # Atualiza o objeto usuário com os dados mais recentes do banco de dados.
-        db.session.refresh(usuario)
+        # O commit é feito antes do envio do email, para que a transação não fique aberta
+        # durante a comunicação com o serviço de email. Se o envio falhar, o usuário pode
+        # pedir um novo email de confirmação (auth.revalida_email).
+        db.session.commit()
         token = create_jwt_token(action=JWT_action.VALIDAR_EMAIL, sub=usuario.email)
-        current_app.logger.debug("Token de validação de email: %s" % (token,))
+        current_app.logger.debug("Token de validação de email: %s", token)
         body = render_template('auth/email_confirmation.jinja2',
                                nome=usuario.nome,
                                url=url_for('auth.valida_email', token=token))
         if not usuario.send_email(subject="Confirme o seu email", body=body):
             flash("Erro no envio do email de confirmação da conta", category="danger")
-        db.session.commit()
         flash("Cadastro efetuado com sucesso. Confirme o seu email antes de logar "
               "no sistema", category='success')
         return redirect(url_for('root.index'))
@@ -98,7 +230,7 @@ def revalida_email(user_id):
         return redirect(url_for('auth.login'))
 
     token = create_jwt_token(action=JWT_action.VALIDAR_EMAIL, sub=usuario.email)
-    current_app.logger.debug("Token de validação de email: %s" % (token,))
+    current_app.logger.debug("Token de validação de email: %s", token)
     body = render_template('auth/email_confirmation.jinja2',
                            nome=usuario.nome,
                            url=url_for('auth.valida_email', token=token))
@@ -111,6 +243,8 @@ def revalida_email(user_id):
 
 
 @bp.route('/login', methods=['GET', 'POST'])
+@limiter.limit("10 per minute", methods=['POST'])
+@limiter.limit("5 per 15 minutes", methods=['POST'], key_func=_chave_email_do_formulario)
 @anonymous_required
 def login():
     """
@@ -131,15 +265,16 @@ def login():
 
     if form.validate_on_submit():
         usuario = User.get_by_email(form.email.data)
+        if usuario is None:
+            # Mantém o tempo de resposta igual ao de uma senha incorreta
+            User.simular_check_password(form.password.data)
 
         if usuario is None or not usuario.check_password(form.password.data):
             flash("Email ou senha incorretos", category='warning')
             return redirect(url_for('auth.login'))
         if not usuario.ativo:
-
-            flash(Markup(f"Usuário está impedido de acessar o sistema. Precisa de um <a href=\""
-                         f"{url_for('auth.revalida_email', user_id=usuario.id)}\""
-                         f">novo email de confirmacao</a>?"), category='warning')
+            flash(_MENSAGEM_USUARIO_IMPEDIDO % url_for('auth.revalida_email', user_id=usuario.id),
+                  category='warning')
             return redirect(url_for('auth.login'))
         if usuario.usa_2fa:
             # CRITICO: Token indicando que a verificação da senha está feita, mas o 2FA
@@ -153,7 +288,7 @@ def login():
                                      'next'       : request.args.get('next')
                                  })
             )
-            current_app.logger.debug("pending_2fa_token: %s" % (session['pending_2fa_token'],))
+            current_app.logger.debug("pending_2fa_token: %s", session['pending_2fa_token'])
             flash("Conclua o login digitando o código do segundo fator de autenticação",
                   category='info')
             return redirect(url_for('auth.get2fa'))
@@ -161,10 +296,10 @@ def login():
         login_user(usuario, remember=form.remember_me.data)
         db.session.commit()
         flash(f"Usuario {usuario.email} logado", category='success')
-        current_app.logger.debug("Usuário %s logado" % (usuario.email,))
+        current_app.logger.debug("Usuário %s logado", usuario.email)
 
         next_page = request.args.get('next')
-        if not next_page or urlsplit(next_page).netloc != '':
+        if not _is_safe_next(next_page):
             next_page = url_for('root.index')
         return redirect(next_page)
 
@@ -173,7 +308,34 @@ def login():
                            form=form)
 
 
+def _abortar_2fa(motivo: str,
+                 mensagem: str,
+                 category: str = 'warning') -> Response:
+    """
+    Interrompe o login com 2FA pendente e volta para a página de login.
+
+    Remove o token de 2FA pendente da sessão (apenas se existir, para não regravar o cookie
+    de sessão sem necessidade), registra o motivo no log com o IP de origem e exibe uma única
+    mensagem ao usuário.
+
+    Args:
+        motivo (str): descrição do problema, registrada no log.
+        mensagem (str): mensagem exibida ao usuário.
+        category (str): categoria da mensagem exibida.
+
+    Returns:
+        Response: Redireciona para a página de login.
+    """
+    if 'pending_2fa_token' in session:
+        session.pop('pending_2fa_token')
+    current_app.logger.warning("%s a partir do IP %s", motivo, request.remote_addr)
+    flash(mensagem, category=category)
+    return redirect(url_for('auth.login'))
+
+
 @bp.route('/get2fa', methods=['GET', 'POST'])
+@limiter.limit("10 per minute", methods=['POST'])
+@limiter.limit("5 per 15 minutes", methods=['POST'], key_func=_chave_sub_do_2fa_pendente)
 @anonymous_required
 def get2fa():
     """
@@ -194,33 +356,27 @@ def get2fa():
     #  está presente. Se não estiver, redireciona para a página de login.
     pending_2fa_token = session.get('pending_2fa_token')
     if not pending_2fa_token:
-        current_app.logger.warning(
-                "Tentativa de acesso 2FA não autorizado a partir do IP %s" % (request.remote_addr,))
-        flash("Acesso negado. Reinicie o processo de login.", category='error')
-        return redirect(url_for('auth.login'))
+        return _abortar_2fa("Tentativa de acesso 2FA não autorizado",
+                            "Acesso negado. Reinicie o processo de login.",
+                            category='error')
 
     dados_token = verify_jwt_token(pending_2fa_token)
-    if not dados_token.get('valid', False) or \
-            dados_token.get('action') != JWT_action.PENDING_2FA or \
-            not dados_token.get('extra_data', False):
-        session.pop('pending_2fa_token', None)
-        current_app.logger.warning(
-                "Tentativa de acesso 2FA com token inválido ou expirado a partir do IP %s" %
-                (request.remote_addr,))
-        flash("Sessão de autenticação inválida ou expirada. Refaça o login.", category='warning')
-        return redirect(url_for('auth.login'))
+    if not dados_token.valid or \
+            dados_token.action is not JWT_action.PENDING_2FA or \
+            not dados_token.extra_data:
+        return _abortar_2fa("Tentativa de acesso 2FA com token inválido ou expirado",
+                            "Sessão de autenticação inválida ou expirada. Refaça o login.")
 
-    user_id = dados_token.get('sub')
-    remember_me = dados_token.get('extra_data').get('remember_me', False)
-    next_page = dados_token.get('extra_data').get('next', None)
+    user_id = dados_token.sub
+    remember_me = dados_token.extra_data.get('remember_me', False)
+    next_page = dados_token.extra_data.get('next', None)
 
     form = Read2FACodeForm()
     if form.validate_on_submit():
         usuario = User.get_by_id(user_id)
         if usuario is None or not usuario.usa_2fa:
-            # Limpa variáveis de sessão e volta para o login
-            session.pop('pending_2fa_token', None)
-            return redirect(url_for('auth.login'))
+            return _abortar_2fa("Tentativa de acesso 2FA para usuário inexistente ou sem 2FA",
+                                "Sessão de autenticação inválida ou expirada. Refaça o login.")
 
         token = str(form.codigo.data)
         resultado, metodo = usuario.verify_2fa_code(token)
@@ -231,7 +387,7 @@ def get2fa():
             usuario.ultimo_otp = token
             db.session.commit()
 
-            if not next_page or urlsplit(next_page).netloc != '':
+            if not _is_safe_next(next_page):
                 next_page = url_for('root.index')
 
             flash(f"Usuario {usuario.email} logado", category='success')
@@ -242,8 +398,8 @@ def get2fa():
             return redirect(next_page)
 
         # Código errado. Registra tentativa falha e permanece na página de 2FA
-        current_app.logger.warning("Código 2FA inválido para usuario %s a partir do IP %s" % (
-            usuario.id, request.remote_addr,))
+        current_app.logger.warning("Código 2FA inválido para usuario %s a partir do IP %s",
+                                   usuario.id, request.remote_addr)
         flash("Código incorreto. Tente novamente", category='warning')
 
     return render_template('auth/2fa.jinja2',
@@ -274,6 +430,7 @@ def logout():
 
 
 @bp.route('/valida_email/<token>')
+@limiter.limit("10 per minute", key_func=_chave_sub_do_token)
 @anonymous_required
 def valida_email(token):
     """
@@ -293,14 +450,14 @@ def valida_email(token):
     """
 
     claims = verify_jwt_token(token)
-    if not (claims.get('valid', False) and {'sub', 'action'}.issubset(claims)):
+    if not claims.valid or claims.sub is None or claims.action is None:
         flash("Token incorreto ou incompleto", category='warning')
         return redirect(url_for('root.index'))
 
-    usuario = User.get_by_email(claims.get('sub'))
+    usuario = User.get_by_email(claims.sub)
     if (usuario is not None and
             not usuario.ativo and
-            claims.get('action') == JWT_action.VALIDAR_EMAIL):
+            claims.action is JWT_action.VALIDAR_EMAIL):
         usuario.ativo = True
         flash(f"Email {usuario.email} validado!", category='success')
         db.session.commit()
@@ -310,6 +467,7 @@ def valida_email(token):
 
 
 @bp.route('/reset_password/<token>', methods=['GET', 'POST'])
+@limiter.limit("5 per 15 minutes", methods=['POST'], key_func=_chave_sub_do_token)
 @anonymous_required
 def reset_password(token):
     """
@@ -329,12 +487,12 @@ def reset_password(token):
     """
 
     claims = verify_jwt_token(token)
-    if not (claims.get('valid', False) and {'sub', 'action'}.issubset(claims)):
+    if not claims.valid or claims.sub is None or claims.action is None:
         flash("Token incorreto ou incompleto", category='warning')
         return redirect(url_for('root.index'))
 
-    usuario = User.get_by_email(claims.get('sub'))
-    if usuario is not None and claims.get('action') == JWT_action.RESET_PASSWORD:
+    usuario = User.get_by_email(claims.sub)
+    if usuario is not None and claims.action is JWT_action.RESET_PASSWORD:
         form = SetNewPasswordForm()
         if form.validate_on_submit():
             usuario.password = form.password.data
@@ -350,6 +508,8 @@ def reset_password(token):
 
 
 @bp.route('/new_password', methods=['GET', 'POST'])
+@limiter.limit("10 per hour", methods=['POST'])
+@limiter.limit("3 per hour", methods=['POST'], key_func=_chave_email_do_formulario)
 @anonymous_required
 def new_password():
     """
@@ -383,7 +543,7 @@ def new_password():
             usuario.send_email(subject="Altere a sua senha", body=body)
             return redirect(url_for('auth.login'))
         current_app.logger.warning(
-                "Pedido de reset de senha para usuário inexistente (%s)" % (email,))
+                "Pedido de reset de senha para usuário inexistente (%s)", email)
         return redirect(url_for('auth.login'))
     return render_template('auth/simple_form.jinja2',
                            title="Esqueci minha senha",
@@ -402,26 +562,40 @@ def imagem(id_usuario, size):
     - Apenas o próprio usuário pode acessar sua imagem.
     - Retorna 404 se o usuário não for o dono, não existir ou não possuir foto.
     - Utiliza o tipo MIME correto para a resposta.
+    - Envia um ETag derivado do conteúdo da foto e responde 304 se o navegador já tiver a
+      versão atual, sem carregar a imagem. Como a URL da imagem não muda quando a foto é
+      trocada, o navegador deve revalidar a cada uso (Cache-Control: no-cache).
 
     Args:
         id_usuario (UUID): Identificador único do usuário.
         size (str): 'full' para foto completa, 'avatar' para avatar.
 
     Returns:
-        Response: Imagem do usuário ou status 404 se não encontrada.
+        Response: Imagem do usuário, status 304 se não foi modificada ou status 404 se não
+        encontrada.
     """
-    if str(current_user.id) != str(id_usuario):
+    if current_user.id != id_usuario:
+        return Response(status=404)
+    if size not in ("full", "avatar"):
         return Response(status=404)
     usuario = User.get_by_id(id_usuario)
     if usuario is None or not usuario.com_foto:
         return Response(status=404)
-    if size == "full":
-        imagem_content, imagem_type = usuario.foto
-    elif size == "avatar":
-        imagem_content, imagem_type = usuario.avatar
+
+    etag = f"{usuario.foto_etag}-{size}" if usuario.foto_etag else None
+    if etag is not None and request.if_none_match.contains(etag):
+        resposta = Response(status=304)
     else:
-        return Response(status=404)
-    return Response(imagem_content, mimetype=imagem_type)
+        if size == "full":
+            imagem_content, imagem_type = usuario.foto
+        else:
+            imagem_content, imagem_type = usuario.avatar
+        resposta = Response(imagem_content, mimetype=imagem_type)
+    if etag is not None:
+        resposta.set_etag(etag)
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    return resposta
 
 
 @bp.route('/', methods=['GET', 'POST'])
@@ -532,7 +706,7 @@ def enable_2fa():
             flash("O código informado foi usado recentemente. Se você está vendo esta mensagem "
                   "repetidamente, desative e reative o 2FA.", category='warning')
             current_app.logger.error(
-                "Usuário %s reutilizou um código TOTP na ativação do 2FA" % (current_user.email,))
+                "Usuário %s reutilizou um código TOTP na ativação do 2FA", current_user.email)
         else:
             flash("O código informado está incorreto. Tente novamente.", category='warning')
         return redirect(url_for('auth.enable_2fa'))
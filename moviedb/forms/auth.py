@@ -1,12 +1,17 @@
+import re
+
 from flask_login import current_user
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileAllowed, FileField
 from wtforms.fields.simple import BooleanField, HiddenField, PasswordField, StringField, SubmitField
-from wtforms.validators import Email, EqualTo, InputRequired, Length
+from wtforms.validators import Email, EqualTo, InputRequired, Length, Regexp
 
 from moviedb.forms.validators import CampoImutavel
 from .validators import SenhaComplexa, UniqueEmail
 
+# Códigos TOTP (6 dígitos) ou códigos reserva (6 letras/números, incluindo minúsculas)
+_CODIGO_2FA = re.compile(r'^[A-Za-z0-9]{6}$')
+
 
 class RegistrationForm(FlaskForm):
     nome = StringField(
@@ -103,7 +108,8 @@ class Read2FACodeForm(FlaskForm):
             label="Código",
             validators=[
                 InputRequired(message="Informe o código fornecido pelo aplicativo autenticador"),
-                Length(min=6, max=6)],
+                Length(min=6, max=6),
+                Regexp(_CODIGO_2FA, message="O código deve ter 6 letras ou números")],
             render_kw={'autocomplete': 'one-time-code',
-                       'pattern'     : r'^[A-Z0-9]{6}$'})
+                       'pattern'     : _CODIGO_2FA.pattern})
     submit = SubmitField("Enviar código")
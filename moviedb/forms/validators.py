@@ -1,3 +1,5 @@
+import re
+from collections import namedtuple
 from typing import Any, Callable, Optional
 
 from flask import current_app
@@ -64,18 +66,18 @@ class CampoImutavel:
             expected_value = getattr(reference_obj, self.attr_name)
             expected_value = self.converter(expected_value)
         except AttributeError:
-            current_app.logger.error("Atributo '%s' não encontrado no objeto %s" %
-                                     (self.attr_name, type(reference_obj).__name__,))
+            current_app.logger.error("Atributo '%s' não encontrado no objeto %s",
+                                     self.attr_name, type(reference_obj).__name__)
             raise ValidationError("Erro interno na validação")
         except Exception as e:
-            current_app.logger.error("Erro ao processar valor de referência para %s: %s" %
-                                     (self.field_name, str(e),))
+            current_app.logger.error("Erro ao processar valor de referência para %s: %s",
+                                     self.field_name, e)
             raise ValidationError("Erro interno na validação")
 
         if field.data != expected_value:
             current_app.logger.warning(
-                    "Violação da integridade: campo %s alterado de '%s' para '%s'" %
-                    (self.field_name, expected_value, field.data,))
+                    "Violação da integridade: campo %s alterado de '%s' para '%s'",
+                    self.field_name, expected_value, field.data)
             raise ValidationError(self.message)
 
 
@@ -108,6 +110,16 @@ class UniqueEmail(object):
             raise ValidationError(self.message)
 
 
+_Teste = namedtuple('_Teste', ['config', 'mensagem', 're'])
+
+_TESTES_DE_SENHA = (
+    _Teste('PASSWORD_MAIUSCULA', "letras maiúsculas", re.compile(r'[A-Z]')),
+    _Teste('PASSWORD_MINUSCULA', "letras minúsculas", re.compile(r'[a-z]')),
+    _Teste('PASSWORD_NUMERO', "números", re.compile(r'\d')),
+    _Teste('PASSWORD_SIMBOLO', "símbolos especiais", re.compile(r'\W'))
+)
+
+
 class SenhaComplexa(object):
     """
     Validador WTForms para garantir que a senha informada atende aos requisitos de complexidade
@@ -137,26 +149,13 @@ class SenhaComplexa(object):
         Raises:
             ValidationError: Se a senha não atender aos requisitos de complexidade.
         """
-        from flask import current_app
-        import re
-        from collections import namedtuple
-
-        Teste = namedtuple('Teste', ['config', 'mensagem', 're'])
-
-        lista_de_testes = [
-            Teste('PASSWORD_MAIUSCULA', "letras maiúsculas", r'[A-Z]'),
-            Teste('PASSWORD_MINUSCULA', "letras minúsculas", r'[a-z]'),
-            Teste('PASSWORD_NUMERO', "números", r'\d'),
-            Teste('PASSWORD_SIMBOLO', "símbolos especiais", r'\W')
-        ]
-
         min_caracteres = current_app.config.get('PASSWORD_MIN', 0)
         senha_valida = (len(field.data) >= min_caracteres)
         mensagens = [f"pelo menos {min_caracteres} caracteres"]
 
-        for teste in lista_de_testes:
+        for teste in _TESTES_DE_SENHA:
             if current_app.config.get(teste.config, False):
-                senha_valida = senha_valida and (re.search(teste.re, field.data) is not None)
+                senha_valida = senha_valida and (teste.re.search(field.data) is not None)
                 mensagens.append(teste.mensagem)
 
         mensagem = "A sua senha precisa conter "
@@ -1,9 +1,14 @@
 from flask_bootstrap import Bootstrap5
+from flask_compress import Compress
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
 bootstrap = Bootstrap5()
+compress = Compress()
 db = SQLAlchemy()
 migrate = Migrate()
 login_manager = LoginManager()
+limiter = Limiter(key_func=get_remote_address)
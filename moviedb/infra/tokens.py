@@ -1,8 +1,9 @@
+from dataclasses import dataclass
 from time import time
 from typing import Any, Dict, Optional
 
 import jwt
-from flask import current_app
+from flask import current_app, g
 
 from moviedb.models.enumeracoes import JWT_action
 
@@ -48,52 +49,73 @@ def create_jwt_token(action: JWT_action = JWT_action.NO_ACTION,
                       algorithm='HS256')
 
 
-def verify_jwt_token(token: str) -> Dict[str, Any]:
+@dataclass(frozen=True, slots=True)
+class JWTClaims:
+    """
+    Resultado da verificação de um token JWT.
+
+    Attributes:
+        valid: Indica se o token é válido.
+        reason: Motivo da invalidade do token (apenas se não for válido).
+        sub: O assunto do token.
+        action: A ação para a qual o token foi criado.
+        age: Idade do token em segundos, se o token tiver a reivindicação 'iat'.
+        extra_data: Dados adicionais incluídos no payload, se houver.
+    """
+    valid: bool = False
+    reason: Optional[str] = None
+    sub: Optional[str] = None
+    action: Optional[JWT_action] = None
+    age: Optional[int] = None
+    extra_data: Optional[Dict[str, Any]] = None
+
+
+def verify_jwt_token(token: str) -> JWTClaims:
     """
     Verifica um token JWT e retorna suas reivindicações.
 
+    O resultado é memorizado durante o contexto da aplicação (isto é, durante a requisição),
+    de modo que verificar o mesmo token mais de uma vez não repete a validação da assinatura.
+
     Args:
         token: O token JWT a ser verificado.
 
     Returns:
-        Um dicionário contendo as reivindicações do token.
-        O dicionário sempre conterá uma chave 'valid' (booleano).
-        Se o token for inválido, uma chave 'reason' pode estar presente.
+        Um objeto JWTClaims com as reivindicações do token.
+        Se o token for inválido, 'valid' será False e 'reason' pode estar preenchido.
         Se o token for válido, ele conterá 'sub', 'action', 'age' e 'extra_data' (se presentes).
     """
-    claims: Dict[str, Any] = {'valid': False}
+    cache = g.setdefault('_jwt_verify_cache', {})
+    if token not in cache:
+        cache[token] = _verify_jwt_token(token)
+    return cache[token]
 
+
+def _verify_jwt_token(token: str) -> JWTClaims:
+    """Decodifica e valida o token JWT. Veja verify_jwt_token()."""
     try:
         payload = jwt.decode(token,
                              key=current_app.config.get('SECRET_KEY'),
                              algorithms=['HS256'])
 
         if not 'sub' in payload:
-            claims.update({'reason': "missing_sub"})
-            return claims
-
-        acao = JWT_action[payload.get('action', 'NO_ACTION')]
-        claims.update({'valid' : True,
-                       'sub'   : payload.get('sub', None),
-                       'action': acao})
+            return JWTClaims(reason="missing_sub")
 
-        if 'iat' in payload:
-            claims.update({'age': int(time()) - int(payload.get('iat'))})
-
-        if 'extra_data' in payload:
-            claims.update({'extra_data': payload.get('extra_data')})
+        return JWTClaims(valid=True,
+                         sub=payload.get('sub', None),
+                         action=JWT_action[payload.get('action', 'NO_ACTION')],
+                         age=int(time()) - int(payload.get('iat')) if 'iat' in payload else None,
+                         extra_data=payload.get('extra_data', None))
 
     except jwt.ExpiredSignatureError as e:
-        current_app.logger.error("JWT Expired: %s" % (e,))
-        claims.update({'reason': "expired"})
+        current_app.logger.error("JWT Expired: %s", e)
+        return JWTClaims(reason="expired")
     except jwt.InvalidTokenError as e:
-        current_app.logger.error("Invalid JWT: %s" % (e,))
-        claims.update({'reason': "invalid"})
+        current_app.logger.error("Invalid JWT: %s", e)
+        return JWTClaims(reason="invalid")
     except jwt.InvalidSignatureError as e:
-        current_app.logger.error("Invalid JWT signature: %s" % (e,))
-        claims.update({'reason': "bad_signature"})
+        current_app.logger.error("Invalid JWT signature: %s", e)
+        return JWTClaims(reason="bad_signature")
     except ValueError as e:
-        current_app.logger.error("ValueError: %s" % (e,))
-        claims.update({'reason': "valueerror"})
-
-    return claims
+        current_app.logger.error("ValueError: %s", e)
+        return JWTClaims(reason="valueerror")
@@ -0,0 +1,69 @@
+"""Foto do usuario em binario
+
+Revision ID: 9a4e2c7d1f05
+Revises: 5c3f0d9a7b21
+Create Date: 2025-10-16 09:41:07.218354
+
+"""
+from base64 import b64decode, b64encode
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4e2c7d1f05'
+down_revision = '5c3f0d9a7b21'
+branch_labels = None
+depends_on = None
+
+
+def _copiar_imagens(origem: tuple[str, str], destino: tuple[str, str], tipo_origem,
+                    tipo_destino, converter):
+    """Copia a foto e o avatar entre os pares de colunas informados, convertendo os valores."""
+    usuarios = sa.table('usuarios',
+                        sa.column('id', sa.Uuid()),
+                        sa.column(origem[0], tipo_origem),
+                        sa.column(origem[1], tipo_origem),
+                        sa.column(destino[0], tipo_destino),
+                        sa.column(destino[1], tipo_destino))
+    conexao = op.get_bind()
+    registros = conexao.execute(
+            sa.select(usuarios.c.id, usuarios.c[origem[0]], usuarios.c[origem[1]]).
+            where(usuarios.c[origem[0]].is_not(None))
+    ).all()
+    for registro in registros:
+        foto, avatar = registro[1], registro[2]
+        conexao.execute(
+                sa.update(usuarios).
+                where(usuarios.c.id == registro.id).
+                values({destino[0]: converter(foto),
+                        destino[1]: converter(avatar) if avatar is not None else None})
+        )
+
+
+def upgrade():
+    with op.batch_alter_table('usuarios', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('foto_bytes', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('avatar_bytes', sa.LargeBinary(), nullable=True))
+
+    # Converte as imagens já cadastradas de base64 para binário
+    _copiar_imagens(('foto_base64', 'avatar_base64'), ('foto_bytes', 'avatar_bytes'),
+                    sa.Text(), sa.LargeBinary(), b64decode)
+
+    with op.batch_alter_table('usuarios', schema=None) as batch_op:
+        batch_op.drop_column('avatar_base64')
+        batch_op.drop_column('foto_base64')
+
+
+def downgrade():
+    with op.batch_alter_table('usuarios', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('foto_base64', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('avatar_base64', sa.Text(), nullable=True))
+
+    _copiar_imagens(('foto_bytes', 'avatar_bytes'), ('foto_base64', 'avatar_base64'),
+                    sa.LargeBinary(), sa.Text(), lambda dados: b64encode(dados).decode('utf-8'))
+
+    with op.batch_alter_table('usuarios', schema=None) as batch_op:
+        batch_op.drop_column('avatar_bytes')
+        batch_op.drop_column('foto_bytes')
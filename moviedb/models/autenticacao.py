@@ -1,44 +1,230 @@
+import functools
+import hashlib
+import hmac
 import io
 import secrets
+import threading
 import uuid
-from base64 import b64decode, b64encode
+import warnings
+from base64 import b64encode
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
 from typing import Optional
 
 import pyotp
-from flask import current_app
+from email_validator import validate_email
+from email_validator.exceptions import EmailNotValidError, EmailSyntaxError
+from flask import current_app, Flask
 from flask_login import UserMixin
 from PIL import Image
+from postmarker.core import PostmarkClient
 from qrcode.main import QRCode
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, select, String, Text, Uuid
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, delete, ForeignKey, Index, insert, Integer, LargeBinary, \
+    select, String, Uuid
+from sqlalchemy.orm import deferred, relationship
+from werkzeug.security import check_password_hash, generate_password_hash
 
 from moviedb import db
 from moviedb.models.enumeracoes import Autenticacao2FA
 from moviedb.models.mixins import BasicRepositoryMixin
 
+# Prefixo das impressões HMAC dos códigos reserva, que as distingue dos hashes do werkzeug
+_PREFIXO_HMAC = 'hmac-sha256$'
 
+# Caracteres dos códigos reserva (sem os que se confundem, como I, l, O, 0 e 1)
+_ALFABETO_CODIGOS = 'ABCDEFGHJKLMNPQRSTUVWXYZabcdefghjkmnpqrstuvwxyz23456789'
+
+
+@functools.lru_cache(maxsize=2048)
 def normalizar_email(email: str) -> Optional[str]:
     """
     Normaliza um endereço de e-mail utilizando a biblioteca email_validator.
 
+    O resultado é memorizado por endereço, pois o mesmo e-mail é normalizado várias vezes na
+    mesma requisição (chave do limitador de tentativas, formulário e setter do modelo).
+
     Args:
         email (str): Endereço de e-mail a ser normalizado.
 
     Returns:
         str: E-mail normalizado em letras minúsculas, ou None se o email for inválido.
     """
-    from email_validator import validate_email
-    from email_validator.exceptions import EmailNotValidError, EmailSyntaxError
     try:
         return validate_email(email, check_deliverability=False).normalized.lower()
     except (EmailNotValidError, EmailSyntaxError, TypeError):
         return None
     except Exception as e:
-        current_app.logger.error("Erro inesperado ao validar email '%s': %s" % (email, str(e),))
+        current_app.logger.error("Erro inesperado ao validar email '%s': %s", email, e)
         return None
 
 
+def _gerar_hash(valor: str) -> str:
+    """
+    Gera o hash de uma senha com o método configurado na aplicação.
+
+    O método é lido da chave PASSWORD_HASH_METHOD (padrão 'scrypt', o mesmo do Werkzeug), o
+    que permite usar um custo menor em desenvolvimento, por exemplo 'pbkdf2:sha256:1000'.
+
+    Args:
+        valor (str): valor a ser protegido.
+
+    Returns:
+        str: hash no formato do werkzeug.security.
+    """
+    return generate_password_hash(valor,
+                                  method=current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt'))
+
+
+def _impressao_codigo_reserva(codigo: str) -> str:
+    """
+    Calcula a impressão digital (HMAC-SHA256 com a SECRET_KEY) de um código reserva do 2FA.
+
+    Os códigos reserva são aleatórios e de uso único, então não precisam de uma função de
+    hash lenta como as senhas: o HMAC é rápido de verificar e, sem a chave, não permite testar
+    códigos a partir do banco de dados. Trocar a SECRET_KEY invalida os códigos existentes.
+
+    Args:
+        codigo (str): código reserva.
+
+    Returns:
+        str: impressão digital com o prefixo _PREFIXO_HMAC, a ser gravada em hash_codigo.
+    """
+    chave = str(current_app.config['SECRET_KEY']).encode()
+    digest = hmac.new(chave, b'backup2fa:' + codigo.encode(), hashlib.sha256).hexdigest()
+    return f"{_PREFIXO_HMAC}{digest}"
+
+
+def _gerar_codigos_aleatorios(quantos: int, tamanho: int = 6) -> list[str]:
+    """
+    Gera códigos aleatórios com os caracteres de _ALFABETO_CODIGOS.
+
+    Os bytes aleatórios são obtidos em blocos com secrets.token_bytes, em vez de uma chamada
+    a secrets.choice por caractere. Bytes maiores ou iguais ao maior múltiplo do tamanho do
+    alfabeto são descartados, para que todos os caracteres sejam igualmente prováveis.
+
+    Args:
+        quantos (int): quantidade de códigos.
+        tamanho (int): quantidade de caracteres de cada código.
+
+    Returns:
+        list[str]: os códigos gerados.
+    """
+    limite = 256 - 256 % len(_ALFABETO_CODIGOS)
+    total = quantos * tamanho
+    caracteres = []
+    while len(caracteres) < total:
+        caracteres.extend(_ALFABETO_CODIGOS[b % len(_ALFABETO_CODIGOS)]
+                          for b in secrets.token_bytes(total) if b < limite)
+    return ["".join(caracteres[i:i + tamanho]) for i in range(0, total, tamanho)]
+
+
+@functools.cache
+def _hash_senha_ficticia(metodo: str) -> str:
+    """
+    Retorna o hash de uma senha aleatória, gerado uma única vez por processo e método.
+
+    Args:
+        metodo (str): método de hash, o mesmo usado para as senhas reais, para que o custo da
+            verificação seja igual.
+
+    Returns:
+        str: hash usado por User.simular_check_password().
+    """
+    return generate_password_hash(secrets.token_urlsafe(16), method=metodo)
+
+
+# Clientes do Postmark de cada thread. O PostmarkClient cria a sessão HTTP de forma
+# preguiçosa e sem sincronização, então não é compartilhado entre as threads de envio.
+_clientes_postmark = threading.local()
+
+
+def _cliente_postmark(server_token: str,
+                      timeout: float) -> PostmarkClient:
+    """
+    Retorna o cliente do Postmark da thread corrente para o token informado.
+
+    O cliente é criado uma única vez por thread (por exemplo, uma vez para cada thread do pool
+    de envio assíncrono). Reaproveitar o cliente mantém a sessão HTTP dele, de modo que as
+    conexões (e o handshake TLS) com a API do Postmark são reutilizadas entre os envios.
+
+    Args:
+        server_token (str): token do servidor no Postmark.
+        timeout (float): tempo máximo, em segundos, de espera pela API do Postmark.
+
+    Returns:
+        PostmarkClient: cliente do Postmark.
+    """
+    clientes = _clientes_postmark.__dict__.setdefault('clientes', {})
+    chave = (server_token, timeout)
+    if chave not in clientes:
+        clientes[chave] = PostmarkClient(server_token=server_token, timeout=timeout)
+    return clientes[chave]
+
+
+# Pool com poucas threads para o envio assíncrono de e-mails (SEND_EMAIL_ASYNC). As threads
+# do pool não são daemon: ao encerrar o processo, o interpretador aguarda os envios já
+# agendados, em vez de descartá-los.
+_executor_de_email = ThreadPoolExecutor(max_workers=4, thread_name_prefix='email')
+
+
+def _registrar_falha_de_envio(app: Flask,
+                              destinatario: str,
+                              envio: Future) -> None:
+    """
+    Registra no log um envio assíncrono cancelado ou interrompido por uma exceção. As falhas
+    informadas pelo Postmark já são registradas por _enviar_email_postmark().
+
+    Args:
+        app (Flask): Aplicação cujo logger será usado.
+        destinatario (str): Endereço de e-mail do destinatário.
+        envio (Future): envio agendado no pool de threads.
+    """
+    if envio.cancelled():
+        app.logger.error("Envio de email para %s cancelado", destinatario)
+    elif envio.exception() is not None:
+        app.logger.error("Erro ao enviar email para %s: %s", destinatario, envio.exception())
+
+
+def _enviar_email_postmark(app: Flask,
+                           destinatario: str,
+                           subject: str,
+                           body: str) -> bool:
+    """
+    Envia um e-mail através do serviço Postmark.
+
+    Usa apenas a configuração e o logger da aplicação recebida, de modo que pode ser executada
+    fora do contexto da requisição (por exemplo, em uma thread separada).
+
+    Args:
+        app (Flask): Aplicação da qual são lidas as configurações do Postmark.
+        destinatario (str): Endereço de e-mail do destinatário.
+        subject (str): Assunto do e-mail.
+        body (str): Corpo do e-mail em texto simples.
+
+    Returns:
+        True se conseguir enviar o e-mail, False caso contrário.
+    """
+    try:
+        postmark = _cliente_postmark(app.config['SERVER_TOKEN'],
+                                     app.config.get('EMAIL_TIMEOUT', 10))
+        conteudo = postmark.emails.Email(
+                From=app.config['EMAIL_SENDER'],
+                To=destinatario,
+                Subject=subject,
+                TextBody=body
+        )
+        response = conteudo.send()
+    except Exception as e:
+        app.logger.error("Erro ao enviar email para %s: %s", destinatario, e)
+        return False
+    app.logger.debug("Email enviado para %s", destinatario)
+    app.logger.debug("Resposta do Postmark: %s", response)
+    if response['ErrorCode'] != 0:
+        app.logger.error("Erro ao enviar email para %s: %s", destinatario, response['Message'])
+        return False
+    return True
+
+
 class User(db.Model, BasicRepositoryMixin, UserMixin):
     __tablename__ = "usuarios"
 
@@ -49,9 +235,12 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
     ativo = Column(Boolean, nullable=False, default=False, server_default='false')
 
     com_foto = Column(Boolean, default=False, server_default='false')
-    foto_base64 = Column(Text, nullable=True, default=None)
-    avatar_base64 = Column(Text, nullable=True, default=None)
+    # As imagens são carregadas apenas quando acessadas (deferred), para que as consultas de
+    # autenticação não tragam a foto do banco de dados.
+    foto_bytes = deferred(Column(LargeBinary, nullable=True, default=None))
+    avatar_bytes = deferred(Column(LargeBinary, nullable=True, default=None))
     foto_mime = Column(String(32), nullable=True, default=None)
+    foto_etag = Column(String(32), nullable=True, default=None)
 
     usa_2fa = Column(Boolean, default=False, server_default='false')
     _otp_secret = Column(String(32), nullable=True, default=None)
@@ -97,8 +286,7 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
     @password.setter
     def password(self, value):
         """Armazena o has da senha do usuário."""
-        from werkzeug.security import generate_password_hash
-        self.password_hash = generate_password_hash(value)
+        self.password_hash = _gerar_hash(value)
 
     @classmethod
     def get_by_email(cls, email: str) -> Optional['User']:
@@ -117,14 +305,32 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
         ).scalar_one_or_none()
 
     def check_password(self, password) -> bool:
-        from werkzeug.security import check_password_hash
         return check_password_hash(self.password_hash, password)
 
+    @staticmethod
+    def simular_check_password(password) -> bool:
+        """
+        Verifica a senha contra um hash fictício, com o mesmo custo de check_password().
+
+        Deve ser usado quando o usuário não existe, para que o tempo de resposta não revele
+        se o email está cadastrado no sistema.
+
+        Args:
+            password (str): senha informada.
+
+        Returns:
+            bool: sempre False.
+        """
+        check_password_hash(
+                _hash_senha_ficticia(current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')),
+                password)
+        return False
+
     @property
     def foto(self) -> (bytes, str):
         """Retorna a foto original do usuário em bytes e o tipo MIME."""
         if self.com_foto:
-            data = b64decode(self.foto_base64)
+            data = self.foto_bytes
             mime_type = self.foto_mime
         else:
             data = None
@@ -135,7 +341,7 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
     def avatar(self) -> (bytes, str):
         """Retorna o avatar do usuário em bytes e o tipo MIME."""
         if self.com_foto:
-            data = b64decode(self.avatar_base64)
+            data = self.avatar_bytes
             mime_type = self.foto_mime
         else:
             data = None
@@ -149,7 +355,7 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
 
         Atualiza os campos relacionados à foto do usuário. Se o valor for None,
         remove a foto e limpa os campos associados. Caso contrário, tenta armazenar
-        a foto em base64 e o tipo MIME. Lida com o caso em que value não possui os
+        a foto e o tipo MIME. Lida com o caso em que value não possui os
         métodos/atributos esperados, registrando o erro.
 
         Args:
@@ -171,8 +377,9 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
                     raise ValueError("Formato de imagem não reconhecido")
 
                 # Armazena dados da imagem original (sem conversão)
-                self.foto_base64 = b64encode(foto_data).decode('utf-8')
+                self.foto_bytes = foto_data
                 self.foto_mime = value.mimetype
+                self.foto_etag = hashlib.blake2b(foto_data, digest_size=16).hexdigest()
                 self.com_foto = True
 
                 # Gera avatar redimensionado no formato original
@@ -187,8 +394,9 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
     def _clear_photo_data(self):
         """Limpa todos os dados relacionados à foto."""
         self.com_foto = False
-        self.foto_base64 = None
-        self.avatar_base64 = None
+        self.foto_bytes = None
+        self.avatar_bytes = None
+        self.foto_etag = None
 
     def _generate_avatar(self, imagem):
         """
@@ -219,43 +427,40 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
             buffer_avatar = io.BytesIO()
             imagem.save(buffer_avatar, format=formato_original, optimize=True)
 
-        self.avatar_base64 = b64encode(buffer_avatar.getvalue()).decode('utf-8')
+        self.avatar_bytes = buffer_avatar.getvalue()
 
     def send_email(self, subject: str,
                    body: str) -> bool:
         """
         Envia um e-mail para o usuário utilizando o serviço Postmark.
 
+        Se a chave de configuração SEND_EMAIL_ASYNC for verdadeira, o envio é agendado no pool
+        de threads de envio e a requisição não espera pela resposta do Postmark. Nesse caso,
+        erros de envio são apenas registrados no log e o retorno é sempre True.
+
         Args:
             subject (str): Assunto do e-mail.
             body (str): Corpo do e-mail em texto simples.
 
         Returns:
-            True se conseguir enviar o e-mail, False caso contrário.
+            True se conseguir enviar (ou agendar o envio) do e-mail, False caso contrário.
         """
         if current_app.config.get('SEND_EMAIL', False):
-            from postmarker.core import PostmarkClient
-            postmark = PostmarkClient(server_token=current_app.config['SERVER_TOKEN'])
-            conteudo = postmark.emails.Email(
-                    From=current_app.config['EMAIL_SENDER'],
-                    To=self.email,
-                    Subject=subject,
-                    TextBody=body
-            )
-            response = conteudo.send()
-            current_app.logger.debug("Email enviado para %s" % (self.email,))
-            current_app.logger.debug("Resposta do Postmark: %s" % (response,))
-            if response['ErrorCode'] != 0:
-                current_app.logger.error("Erro ao enviar email para %s: %s" %
-                                         (self.email, response['Message'],))
-                return False
+            app = current_app._get_current_object()
+            if current_app.config.get('SEND_EMAIL_ASYNC', False):
+                envio = _executor_de_email.submit(_enviar_email_postmark,
+                                                  app, self.email, subject, body)
+                envio.add_done_callback(functools.partial(_registrar_falha_de_envio,
+                                                          app, self.email))
+                return True
+            return _enviar_email_postmark(app, self.email, subject, body)
         else:
             current_app.logger.debug("Mensagem que SERIA enviada")
-            current_app.logger.debug("From: %s" % (current_app.config['EMAIL_SENDER'],))
-            current_app.logger.debug("To: %s" % (self.email,))
-            current_app.logger.debug("Subject: %s" % (subject,))
+            current_app.logger.debug("From: %s", current_app.config['EMAIL_SENDER'])
+            current_app.logger.debug("To: %s", self.email)
+            current_app.logger.debug("Subject: %s", subject)
             current_app.logger.debug("", )
-            current_app.logger.debug("%s" % (body,))
+            current_app.logger.debug("%s", body)
         return True
 
     @property
@@ -313,7 +518,6 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
 
         Use verify_2fa_code() no lugar.
         """
-        import warnings
         warnings.warn("verify_totp está descontinuado e será removido em versões futuras. "
                       "Use verify_2fa_code() para verificação unificada de códigos 2FA",
                       DeprecationWarning, stacklevel=2)
@@ -330,21 +534,38 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
 
         Use verify_2fa_code() no lugar.
         """
-        import warnings
         warnings.warn("verify_totp_backup está descontinuado e será removido em versões futuras. "
                       "Use verify_2fa_code() para verificação unificada de códigos 2FA",
                       DeprecationWarning, stacklevel=2)
         return self._verify_totp(token)
 
     def _verify_totp_backup(self, token) -> bool:
-        """Metodo interno para verificar o código de backup 2FA."""
-        from werkzeug.security import check_password_hash
-        for codigo in self.lista_2fa_backup:
-            if check_password_hash(codigo.hash_codigo, token):
-                db.session.delete(codigo)
-                db.session.commit()
-                return True
-        return False
+        """
+        Metodo interno para verificar o código de backup 2FA.
+
+        Os códigos gerados com a impressão HMAC são localizados diretamente no banco de dados,
+        pelo índice (usuario_id, hash_codigo). Só se o código não for encontrado é que os
+        códigos antigos, gravados com generate_password_hash, são carregados e verificados com
+        check_password_hash.
+        """
+        codigo = db.session.execute(
+                select(Backup2FA).
+                where(Backup2FA.usuario_id == self.id,
+                      Backup2FA.hash_codigo == _impressao_codigo_reserva(token)).
+                limit(1)
+        ).scalar_one_or_none()
+        if codigo is None:
+            legados = db.session.execute(
+                    select(Backup2FA).
+                    where(Backup2FA.usuario_id == self.id,
+                          ~Backup2FA.hash_codigo.startswith(_PREFIXO_HMAC, autoescape=True))
+            ).scalars()
+            codigo = next((c for c in legados if check_password_hash(c.hash_codigo, token)), None)
+        if codigo is None:
+            return False
+        db.session.delete(codigo)
+        db.session.commit()
+        return True
 
     def verify_2fa_code(self, token, totp_only: bool = False) -> tuple[bool, Autenticacao2FA]:
         """
@@ -360,8 +581,10 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
             tuple[bool, Autenticacao2FA]: (success, auth_method) onde auth_method é o tipo de 2FA
             usado.
         """
-        # Verifica se o código é o mesmo usado por último (não é válido)
-        if token == self.ultimo_otp:
+        # Verifica se o código é o mesmo usado por último (não é válido). A comparação é feita
+        # em tempo constante, assim como a do pyotp e a dos hashes dos códigos reserva
+        if token is not None and self.ultimo_otp is not None and \
+                hmac.compare_digest(str(token).encode(), self.ultimo_otp.encode()):
             return False, Autenticacao2FA.REUSED
 
         # Tenta TOTP primeiro
@@ -383,7 +606,8 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
         Gera códigos de backup para autenticação 2FA do usuário.
 
         Remove todos os códigos de backup anteriores e cria novos códigos aleatórios,
-        armazenando-os de forma segura no banco de dados.
+        armazenando-os de forma segura no banco de dados. A remoção e a inserção em lote
+        são feitas na mesma transação.
 
         Args:
             quantos (int): Quantidade de códigos de backup a serem gerados. Padrão: 5.
@@ -391,20 +615,14 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
         Returns:
             list[str]: lista dos códigos de backup gerados.
         """
-        from werkzeug.security import generate_password_hash
         # Remove os códigos anteriores
-        for codigo in self.lista_2fa_backup:
-            db.session.delete(codigo)
+        self._remover_codigos_reserva()
         # Gera novos códigos
-        codigos = []
-        for _ in range(quantos):
-            codigo = "".join(
-                    secrets.choice('ABCDEFGHJKLMNPQRSTUVWXYZabcdefghjkmnpqrstuvwxyz23456789') for _
-                    in range(6))
-            codigos.append(codigo)
-            backup2fa = Backup2FA()
-            backup2fa.hash_codigo = generate_password_hash(codigo)
-            self.lista_2fa_backup.append(backup2fa)
+        codigos = _gerar_codigos_aleatorios(quantos)
+        db.session.execute(insert(Backup2FA),
+                           [{'usuario_id' : self.id,
+                             'hash_codigo': _impressao_codigo_reserva(codigo)}
+                            for codigo in codigos])
         db.session.commit()
         return codigos
 
@@ -452,14 +670,25 @@ class User(db.Model, BasicRepositoryMixin, UserMixin):
         self.usa_2fa = False
         self._otp_secret = None
         self.ultimo_otp = None
-        for codigo in self.lista_2fa_backup:
-            db.session.delete(codigo)
+        self._remover_codigos_reserva()
         db.session.commit()
         return True
 
+    def _remover_codigos_reserva(self) -> None:
+        """
+        Remove todos os códigos reserva do usuário com um único DELETE, sem carregá-los.
+
+        A coleção lista_2fa_backup é expirada, para ser recarregada (vazia) no próximo acesso.
+        """
+        db.session.execute(delete(Backup2FA).where(Backup2FA.usuario_id == self.id))
+        db.session.expire(self, ['lista_2fa_backup'])
+
 
 class Backup2FA(db.Model):
     __tablename__ = 'backup2fa'
+    __table_args__ = (
+        Index('ix_backup2fa_usuario_id_hash_codigo', 'usuario_id', 'hash_codigo'),
+    )
 
     id = Column(Integer, primary_key=True)
     hash_codigo = Column(String(256), nullable=False)
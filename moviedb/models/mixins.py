@@ -1,3 +1,4 @@
+import functools
 import uuid
 from typing import Any, Dict, Optional, Self, Union
 
@@ -12,6 +13,36 @@ class BasicRepositoryMixin:
     para operações comuns de consulta.
     """
 
+    @classmethod
+    @functools.cache
+    def _colunas_ordenaveis(cls) -> frozenset[str]:
+        """
+        Retorna os nomes dos atributos mapeados para colunas, aceitos em order_by.
+
+        O conjunto é calculado uma única vez por classe. Propriedades Python e relações não
+        são incluídas, pois não podem ser usadas na ordenação.
+
+        Returns:
+            frozenset[str]: nomes dos atributos de coluna da classe.
+        """
+        return frozenset(atributo.key for atributo in sa.inspect(cls).column_attrs)
+
+    @classmethod
+    @functools.cache
+    def _chaves_uuid(cls) -> frozenset[str]:
+        """
+        Retorna os nomes dos atributos da chave primária cujas colunas são do tipo Uuid.
+
+        O conjunto é calculado uma única vez por classe.
+
+        Returns:
+            frozenset[str]: nomes dos atributos da chave primária do tipo Uuid.
+        """
+        mapper = sa.inspect(cls)
+        return frozenset(mapper.get_property_by_column(coluna).key
+                         for coluna in mapper.primary_key
+                         if isinstance(coluna.type, sa.Uuid))
+
     @classmethod
     def is_empty(cls) -> bool:
         """
@@ -20,7 +51,7 @@ class BasicRepositoryMixin:
         Returns:
             bool: True se não houver registros, False caso contrário.
         """
-        return not db.session.execute(sa.select(cls).limit(1)).scalar_one_or_none()
+        return not db.session.scalar(sa.select(sa.exists().select_from(cls)))
 
     @classmethod
     def get_by_id(cls, cls_id) -> Optional[Self] | None:
@@ -33,6 +64,8 @@ class BasicRepositoryMixin:
         Returns:
             Optional[Self]: Instância encontrada ou None.
         """
+        if isinstance(cls_id, uuid.UUID):
+            return db.session.get(cls, cls_id)
         try:
             obj_id = uuid.UUID(str(cls_id))
         except ValueError:
@@ -54,7 +87,7 @@ class BasicRepositoryMixin:
             Result: Iterável de instâncias.
         """
         sentenca = sa.select(cls)
-        if order_by is not None and hasattr(cls, order_by):
+        if order_by is not None and order_by in cls._colunas_ordenaveis():
             sentenca = sentenca.order_by(getattr(cls, order_by))
         if top_n > 0:
             sentenca = sentenca.limit(top_n)
@@ -73,7 +106,30 @@ class BasicRepositoryMixin:
             Result: Iterável de instâncias.
         """
         sentenca = sa.select(cls)
-        if order_by is not None and hasattr(cls, order_by):
+        if order_by is not None and order_by in cls._colunas_ordenaveis():
+            sentenca = sentenca.order_by(getattr(cls, order_by))
+        return db.session.execute(sentenca).scalars()
+
+    @classmethod
+    def stream_all(cls,
+                   order_by: Optional[str] = None,
+                   batch_size: int = 1000):
+        """
+        Percorre todos os registros em lotes, opcionalmente ordenados por um atributo.
+
+        Diferente de get_all(), as linhas são buscadas do banco de dados e convertidas em
+        instâncias aos poucos (yield_per), de modo que a memória usada é limitada a um lote.
+        Indicado para percorrer tabelas grandes apenas para leitura.
+
+        Args:
+            order_by (Optional[str]): Nome do atributo para ordenação.
+            batch_size (int): Quantidade de registros buscados por vez.
+
+        Returns:
+            Result: Iterável de instâncias.
+        """
+        sentenca = sa.select(cls).execution_options(yield_per=batch_size)
+        if order_by is not None and order_by in cls._colunas_ordenaveis():
             sentenca = sentenca.order_by(getattr(cls, order_by))
         return db.session.execute(sentenca).scalars()
 
@@ -83,18 +139,25 @@ class BasicRepositoryMixin:
         """
         Busca um registro por um ID composto.
 
+        Apenas os campos da chave primária do tipo Uuid são convertidos para uuid.UUID; o
+        dicionário recebido não é alterado.
+
         Args:
             cls_dict_id (Dict[str, Any]): Dicionário com os campos do ID composto.
 
         Returns:
             Optional[Self]: Instância encontrada ou None.
         """
+        colunas_uuid = cls._chaves_uuid()
+        chave = {}
         for k, v in cls_dict_id.items():
-            try:
-                cls_dict_id[k] = uuid.UUID(str(v))
-            except ValueError:
-                cls_dict_id[k] = v
-        return db.session.get(cls, cls_dict_id)
+            if k in colunas_uuid and not isinstance(v, uuid.UUID):
+                try:
+                    v = uuid.UUID(str(v))
+                except ValueError:
+                    pass
+            chave[k] = v
+        return db.session.get(cls, chave)
 
     @classmethod
     def get_first_or_none_by(cls,